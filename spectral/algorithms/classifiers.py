@@ -6,19 +6,93 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import logging
 import math
-import numpy
+import os
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 from warnings import warn
 
 import spectral as spy
-from .algorithms import GaussianStats, ImageIterator
-from .detectors import RX
+from .algorithms import GaussianStats
 from .perceptron import Perceptron
 
 __all__ = ('GaussianClassifier', 'MahalanobisDistanceClassifier',
            'PerceptronClassifier')
 
+try:
+    from numba import njit, prange
+    _have_numba = True
+except ImportError:
+    _have_numba = False
+
+try:
+    import cupy as cp
+    # cupy imports successfully on machines with no usable CUDA device, so
+    # require an actual device before enabling the GPU path.
+    try:
+        _have_cupy = cp.cuda.runtime.getDeviceCount() > 0
+    except cp.cuda.runtime.CUDARuntimeError:
+        _have_cupy = False
+except ImportError:
+    _have_cupy = False
+
+if _have_numba:
+    def _build_mahal_scores(B, C):
+        '''Returns a Gaussian scoring kernel specialized to `B` bands and
+        `C` classes.
+
+        For each pixel n and class c, the kernel accumulates the Mahalanobis
+        quadratic ||inv(L_c) (x_n - mean_c)||^2 from the lower-triangular
+        Cholesky inverses `Ls_inv` and writes `consts[c] - 0.5 * quad` to
+        `out[n, c]`. Parallel over pixels, with the inner band loops
+        auto-vectorized; since each `Ls_inv[c]` is lower triangular, the
+        inner accumulation only visits the j <= k entries, halving the
+        multiply-adds of a full matrix-vector product.
+
+        `B` and `C` are closure variables, which numba freezes as
+        compile-time constants, so LLVM sees literal loop bounds and can
+        unroll and vectorize for the exact shape. The caller is expected to
+        wrap the returned function with `njit` and cache the compiled kernel
+        for as long as the shape remains fixed.
+        '''
+        def _mahal_scores(image, means, Ls_inv, consts, out):
+            N = image.shape[0]
+            for n in prange(N):
+                for c in range(C):
+                    q = 0.0
+                    for k in range(B):
+                        acc = 0.0
+                        for j in range(k + 1):
+                            acc += Ls_inv[c, k, j] * \
+                                (image[n, j] - means[c, j])
+                        q += acc * acc
+                    out[n, c] = consts[c] - 0.5 * q
+        return _mahal_scores
+
+def _regularized_cholesky(C):
+    '''Returns `(L, eps)`, where `L` is the Cholesky factor of symmetric
+    matrix `C` after adding diagonal loading `eps` to make it positive
+    definite. `eps` is 0 if `C` could be factored directly; otherwise it is
+    the smallest tried loading for which the factorization succeeded (e.g.,
+    for the rank-deficient sample covariance of a class with barely
+    `min_samples` samples).
+    '''
+    try:
+        return (np.linalg.cholesky(C), 0.)
+    except np.linalg.LinAlgError:
+        pass
+    eps = max(np.abs(C).max(), 1.) * np.finfo(np.float64).eps
+    I = np.eye(C.shape[0])
+    for _ in range(40):
+        try:
+            return (np.linalg.cholesky(C + eps * I), eps)
+        except np.linalg.LinAlgError:
+            eps *= 10.
+    raise np.linalg.LinAlgError('Matrix could not be regularized to '
+                                'positive definite.')
+
+
 class Classifier(object):
     '''
     Base class for Classifiers.  Child classes must implement the
@@ -34,10 +108,36 @@ class Classifier(object):
     def __init__(self):
         pass
 
+    # Number of pixels for which scores are computed at a time when
+    # classifying an image. Bounds peak memory usage of `classify_image`
+    # while keeping chunks large enough for vectorized evaluation.
+    classify_chunk_size = 65536
+
     def classify_spectrum(self, *args, **kwargs):
         raise NotImplementedError('Classifier.classify_spectrum must be '
                                   'overridden by a child class.')
 
+    def classify_spectra(self, X):
+        '''Classifies a batch of spectra.
+
+        Arguments:
+
+            `X` (ndarray):
+
+                An `NxB` array of spectra to classify.
+
+        Returns (ndarray):
+
+            A length-N ndarray of integers specifying the class for each
+            spectrum.
+
+        The default implementation loops over `classify_spectrum`. Child
+        classes should override this method with a vectorized implementation
+        where possible.
+        '''
+        classify = self.classify_spectrum
+        return np.array([classify(x) for x in X])
+
     def classify_image(self, image):
         '''Classifies an entire image, returning a classification map.
 
@@ -53,17 +153,33 @@ class Classifier(object):
         '''
         status = spy._status
         status.display_percentage('Classifying image...')
-        it = ImageIterator(image)
-        class_map = np.zeros(image.shape[:2], np.int16)
-        N = it.get_num_elements()
-        i, inc = (0, N / 100)
-        for spectrum in it:
-            class_map[it.row, it.col] = self.classify_spectrum(spectrum)
-            i += 1
-            if not i % inc:
-                status.update_percentage(float(i) / N * 100.)
+        shape = image.shape
+        (nrows, ncols, nbands) = (shape[0], shape[1], shape[-1])
+        N = nrows * ncols
+        class_map = np.empty(N, np.int16)
+        if isinstance(image, np.ndarray):
+            # Classify flattened pixels in chunks to cap peak memory.
+            flat = image.reshape(-1, nbands)
+            for start in range(0, N, self.classify_chunk_size):
+                stop = min(start + self.classify_chunk_size, N)
+                class_map[start:stop] = self.classify_spectra(flat[start:stop])
+                status.update_percentage(100. * stop / N)
+        else:
+            # Image data must be read from a file or transformed view, so
+            # pull out blocks of rows and classify each block at once.
+            chunk_rows = max(1, self.classify_chunk_size // ncols)
+            i = 0
+            for r in range(0, nrows, chunk_rows):
+                block = np.asarray(image[r: r + chunk_rows, :, :])
+                # The pixel count is derived from the block size because
+                # some image types squeeze single-row reads to 2-D.
+                npixels = block.size // nbands
+                class_map[i: i + npixels] = \
+                    self.classify_spectra(block.reshape(-1, nbands))
+                i += npixels
+                status.update_percentage(100. * i / N)
         status.end_percentage()
-        return class_map
+        return class_map.reshape(shape[:2])
 
     def classify(self, X, **kwargs):
         if X.ndim == 1:
@@ -82,6 +198,31 @@ class SupervisedClassifier(Classifier):
 
 class GaussianClassifier(SupervisedClassifier):
     '''A Gaussian Maximum Likelihood Classifier'''
+
+    # dtype with which image pixels are streamed through the batch scoring
+    # computations. Since only the argmax over class scores is kept, float32
+    # provides ample precision for the quadratic form while halving memory
+    # bandwidth relative to float64. Set to np.float64 for full-precision
+    # scores. Statistics are always factored in float64 for stability.
+    score_dtype = np.float32
+
+    # Minimum number of pixels in an image before scoring is offloaded to
+    # the GPU (when cupy is available). For small images the host-device
+    # transfer outweighs the speedup of the device GEMMs.
+    gpu_min_pixels = 1 << 20
+
+    # Number of threads used to score classes concurrently on the NumPy
+    # path (i.e., when neither numba nor cupy is handling the image). BLAS
+    # releases the GIL during the per-class GEMMs, so threads scale without
+    # the pickling cost of multiprocessing. None selects the smaller of the
+    # class count and the CPU count; set to 1 to force serial scoring.
+    # Note that if the BLAS library is itself multithreaded, running
+    # several workers can oversubscribe cores; in that case limit the BLAS
+    # thread count (e.g., OMP_NUM_THREADS / MKL_NUM_THREADS) so that
+    # workers times BLAS threads does not exceed the core count, or set
+    # score_threads to 1.
+    score_threads = None
+
     def __init__(self, training_data=None, min_samples=None):
         '''Creates the classifier and optionally trains it with training data.
 
@@ -128,6 +269,88 @@ class GaussianClassifier(SupervisedClassifier):
         for cl in self.classes:
             if not hasattr(cl, 'stats') or not cl.stats_valid():
                 cl.calc_stats()
+        self._update_batch_stats()
+
+    def _stack_class_labels(self):
+        '''Stacks class means and label indices into contiguous arrays.'''
+        self._M = np.array([c.stats.mean for c in self.classes])
+        self._inds = np.array([c.index for c in self.classes], np.int32)
+        # When class labels are already 0..C-1, argmax output can be used
+        # directly as the classification map with no gather step.
+        self._identity_labels = np.array_equal(self._inds,
+                                               np.arange(len(self._inds)))
+
+    def _update_batch_stats(self):
+        '''Precomputes stacked class statistics used by `classify_image`.
+
+        Expanding the quadratic form as
+
+            (x - u)' W (x - u) = x' W x - 2 u' W x + u' W u,  W = inv(cov),
+
+        allows all class-dependent terms to be folded into arrays that are
+        computed once here, so classifying an image requires only batched
+        contractions over the pixel axis.
+
+        Since each covariance is symmetric positive definite, W is not
+        materialized directly. Instead, cov = L L' is factored by Cholesky
+        decomposition and U = inv(L)' is stored, giving x' W x = ||x U||^2
+        with a triangular factor and a log-determinant that is cheaper and
+        more stable than going through the eigenvalues.
+        '''
+        logger = logging.getLogger('spectral')
+        self._stack_class_labels()
+        M = self._M
+        Ls = []
+        for c in self.classes:
+            (Lc, eps) = _regularized_cholesky(c.stats.cov)
+            if eps > 0:
+                logger.warn('Covariance for class %d is not positive '
+                            'definite; applied diagonal loading of %g.',
+                            c.index, eps)
+            Ls.append(Lc)
+        L = np.array(Ls)
+        diags = np.array([np.diag(Lc) for Lc in L])
+        rcond = (diags.min(axis=1) / diags.max(axis=1)) ** 2
+        for (i, r) in enumerate(rcond):
+            if r < np.finfo(np.float64).eps:
+                logger.warn('Covariance for class %d is poorly conditioned '
+                            '(rcond ~ %g); scores may be unreliable.',
+                            self.classes[i].index, r)
+        self._Linv = np.array([np.linalg.inv(Lc) for Lc in L])
+        self._U = np.ascontiguousarray(self._Linv.transpose(0, 2, 1))
+        log_det_cov = 2 * np.sum(np.log(diags), axis=1)
+        Umu = np.einsum('cjk,cj->ck', self._U, M)
+        self._Winv_mu = np.einsum('cbk,ck->cb', self._U, Umu)
+        self._mu_W_mu = np.einsum('ck,ck->c', Umu, Umu)
+        self._const = np.log([c.class_prob for c in self.classes]) \
+            - 0.5 * log_det_cov - 0.5 * self._mu_W_mu
+        # Seed the per-class cached derived stats from the (possibly
+        # regularized) factors, so classify_spectrum scores stay consistent
+        # with the batched path and the first classification call pays no
+        # lazy factorization cost.
+        for (i, cl) in enumerate(self.classes):
+            cl.stats._inv_cov = self._Linv[i].T.dot(self._Linv[i])
+            cl.stats._log_det_cov = log_det_cov[i]
+        # The factors above are computed in float64; image streaming happens
+        # at `score_dtype`, so downcast the inference arrays once here.
+        dt = np.dtype(self.score_dtype)
+        if dt != np.float64:
+            for attr in ('_M', '_Linv', '_U', '_Winv_mu', '_mu_W_mu',
+                         '_const'):
+                setattr(self, attr, getattr(self, attr).astype(dt))
+        if _have_cupy:
+            # Upload the inference arrays once so classify_image only has to
+            # transfer image blocks to the device.
+            self._U_dev = cp.asarray(self._U)
+            self._Winv_mu_dev = cp.asarray(self._Winv_mu)
+            self._const_dev = cp.asarray(self._const)
+        if _have_numba:
+            # The scoring kernel is specialized to the now-known band and
+            # class counts so its loop bounds are compile-time constants.
+            # Compilation itself still happens on the kernel's first call.
+            (C, B) = self._M.shape
+            self._kernel = njit(parallel=True, fastmath=True)(
+                _build_mahal_scores(B, C))
 
     def classify_spectrum(self, x):
         '''
@@ -150,9 +373,85 @@ class GaussianClassifier(SupervisedClassifier):
         for (i, cl) in enumerate(self.classes):
             delta = (x - cl.stats.mean)
             scores[i] = math.log(cl.class_prob) - 0.5 * cl.stats.log_det_cov \
-               - 0.5 * delta.dot(cl.stats.inv_cov).dot(delta)
+               - 0.5 * delta.dot(cl.stats.inv_cov.dot(delta))
         return self.classes[np.argmax(scores)].index
             
+    def _get_score_pool(self, nthreads):
+        '''Returns a persistent worker pool of `nthreads` threads for
+        per-class scoring, creating it lazily on first use and rebuilding it
+        only if the requested thread count changes. classify_image calls
+        `_class_scores` once per pixel block, so the pool must outlive
+        individual calls rather than being torn down per block.
+        '''
+        if getattr(self, '_score_pool', None) is None \
+                or self._score_pool_size != nthreads:
+            if getattr(self, '_score_pool', None) is not None:
+                self._score_pool.shutdown(wait=False)
+            self._score_pool = ThreadPoolExecutor(nthreads)
+            self._score_pool_size = nthreads
+        return self._score_pool
+
+    def _class_scores(self, X):
+        '''Returns an `NxC` array of class discriminant scores for the `NxB`
+        array of spectra in `X`.'''
+        dt = np.dtype(self.score_dtype)
+        # Rows must stride contiguously by B elements so that the per-class
+        # GEMMs and the trailing-axis reductions below run at unit stride.
+        X = np.ascontiguousarray(X, dtype=dt)
+        scores = np.empty((X.shape[0], len(self.classes)), dt)
+        if _have_numba:
+            # The compiled kernel evaluates the unexpanded quadratic directly,
+            # so its per-class constants exclude the u' W u term.
+            self._kernel(X, self._M, self._Linv,
+                         self._const + 0.5 * self._mu_W_mu, scores)
+        else:
+            # With the quadratic form expanded (see `_update_batch_stats`),
+            # each class quadratic term is ||x U||^2 for a precomputed
+            # triangular factor U, and the cross terms for all classes reduce
+            # to a single N x C GEMM over the image.
+            nthreads = self.score_threads
+            if nthreads is None:
+                nthreads = min(len(self.classes), os.cpu_count() or 1)
+            if nthreads > 1:
+                # Classes are scored independently, so fan the per-class
+                # GEMMs out over a thread pool. Each worker allocates its
+                # own GEMM output, which the GIL-free BLAS calls amortize.
+                def score_class(i):
+                    Z = X.dot(self._U[i])
+                    np.einsum('ij,ij->i', Z, Z, out=scores[:, i])
+                pool = self._get_score_pool(nthreads)
+                list(pool.map(score_class, range(len(self.classes))))
+            else:
+                # A single scratch buffer holds each class's GEMM output;
+                # since X is C-contiguous (enforced above), np.dot can write
+                # into it directly and no per-class temporary is allocated.
+                Z = np.empty(X.shape, dt)
+                for i in range(len(self.classes)):
+                    np.dot(X, self._U[i], out=Z)
+                    scores[:, i] = np.einsum('ij,ij->i', Z, Z)
+            scores *= -0.5
+            scores += self._const + X.dot(self._Winv_mu.T)
+        return scores
+
+    def classify_spectra(self, X):
+        '''Classifies a batch of spectra.
+
+        Arguments:
+
+            `X` (ndarray):
+
+                An `NxB` array of spectra to classify.
+
+        Returns (ndarray):
+
+            A length-N ndarray of integers specifying the class for each
+            spectrum.
+        '''
+        if not self.cache_class_scores:
+            return super(GaussianClassifier, self).classify_spectra(X)
+        scores = self._class_scores(np.asarray(X))
+        return self._inds[np.argmax(scores, axis=-1)]
+
     def classify_image(self, image):
         '''Classifies an entire image, returning a classification map.
 
@@ -172,36 +471,60 @@ class GaussianClassifier(SupervisedClassifier):
         status = spy._status
         status.display_percentage('Processing...')
         shape = image.shape
-        image = image.reshape(-1, shape[-1])
-        scores = np.empty((image.shape[0], len(self.classes)), np.float64)
-        delta = np.empty_like(image, dtype=np.float64)
-
-        # For some strange reason, creating Y with np.emtpy_like will sometimes
-        # result in the following error when attempting an in-place np.dot:
-        #     ValueError: output array is not acceptable (must have the right
-        #     type, nr dimensions, and be a C-Array)
-        # It appears that this may be happening when delta is not contiguous,
-        # although it isn't clear why the alternate construction of Y below
-        # does work.
-        Y = np.empty_like(delta)
-
-        for (i, c) in enumerate(self.classes):
-            scalar = math.log(c.class_prob) - 0.5 * c.stats.log_det_cov
-            delta = np.subtract(image, c.stats.mean, out=delta)
-            try:
-                Y = delta.dot(-0.5 * c.stats.inv_cov, out=Y)
-            except:
-                # Unable to output np.dot to existing array. Allocate new
-                # storage instead. This will not affect results but may be
-                # slower.
-                Y = delta.dot(-0.5 * c.stats.inv_cov)
-            scores[:, i] = np.einsum('ij,ij->i', Y, delta)
-            scores[:, i] += scalar
-            status.update_percentage(100. * (i + 1) / len(self.classes))
+        X = image.reshape(-1, shape[-1])
+        N = X.shape[0]
+        if _have_cupy and N >= self.gpu_min_pixels:
+            out_inds = self._classify_image_gpu(X)
+            status.end_percentage()
+            return out_inds.reshape(shape[:2])
+        out_inds = np.empty(N, self._inds.dtype)
+        # Score pixels in blocks sized to stay resident in cache across the
+        # per-class scoring loop. This also avoids materializing the full
+        # N x C score array; only each block's scores are kept.
+        block = max(1, (2 << 20) // (shape[-1] * 8))
+        for start in range(0, N, block):
+            stop = min(start + block, N)
+            mins = self._class_scores(X[start:stop]).argmax(axis=-1)
+            if self._identity_labels:
+                out_inds[start:stop] = mins
+            else:
+                np.take(self._inds, mins, out=out_inds[start:stop])
+            status.update_percentage(100. * stop / N)
         status.end_percentage()
-        inds = np.array([c.index for c in self.classes], dtype=np.int16)
-        mins = np.argmax(scores, axis=-1)
-        return inds[mins].reshape(shape[:2])
+        return out_inds.reshape(shape[:2])
+
+    def _classify_image_gpu(self, X):
+        '''Scores flattened image `X` on the GPU, returning class labels.
+
+        Runs the same expanded-quadratic scoring as the host path but on
+        cupy arrays, so the dominant per-class GEMMs execute in cuBLAS.
+        Pixels are uploaded and scored in fixed-size blocks to bound device
+        memory, and only the winning label indices are transferred back to
+        the host.
+        '''
+        (N, B) = X.shape
+        C = len(self.classes)
+        dt = np.dtype(self.score_dtype)
+        out = np.empty(N, self._inds.dtype)
+        # Block size chosen to keep the pixel block, one GEMM output, and
+        # the block's scores within a ~256 MB device budget.
+        block = max(1, (256 << 20) // ((2 * B + C) * dt.itemsize))
+        scores = cp.empty((min(block, N), C), dt)
+        for start in range(0, N, block):
+            stop = min(start + block, N)
+            Xd = cp.asarray(np.ascontiguousarray(X[start:stop], dtype=dt))
+            sc = scores[:stop - start]
+            for i in range(C):
+                Z = Xd.dot(self._U_dev[i])
+                sc[:, i] = cp.einsum('ij,ij->i', Z, Z)
+            sc *= -0.5
+            sc += self._const_dev + Xd.dot(self._Winv_mu_dev.T)
+            mins = cp.asnumpy(sc.argmax(axis=-1))
+            if self._identity_labels:
+                out[start:stop] = mins
+            else:
+                np.take(self._inds, mins, out=out[start:stop])
+        return out
 
 
 class MahalanobisDistanceClassifier(GaussianClassifier):
@@ -217,11 +540,42 @@ class MahalanobisDistanceClassifier(GaussianClassifier):
         '''
         GaussianClassifier.train(self, trainingData)
 
-        covariance = numpy.zeros(self.classes[0].stats.cov.shape, numpy.float)
-        nsamples = np.sum(cl.stats.nsamples for cl in self.classes)
-        for cl in self.classes:
-            covariance += (cl.stats.nsamples / float(nsamples)) * cl.stats.cov
+        covs = np.array([cl.stats.cov for cl in self.classes])
+        ns = np.array([cl.stats.nsamples for cl in self.classes], np.float64)
+        covariance = np.einsum('c,cij->ij', ns / ns.sum(), covs)
         self.background = GaussianStats(cov=covariance)
+        # Compute the background inverse now rather than lazily on the first
+        # call to one of the classification methods.
+        self.background.inv_cov
+        # With cov = LL' shared by all classes, inv(cov) = U'U for
+        # U = inv(L), so the Mahalanobis distance is the Euclidean distance
+        # in the whitened space z = Ux. Whiten the class means once here;
+        # classification then whitens each pixel once and measures
+        # distance-to-point for every class.
+        dt = np.dtype(self.score_dtype)
+        (Lbg, eps) = _regularized_cholesky(covariance)
+        if eps > 0:
+            logging.getLogger('spectral').warn(
+                'Pooled background covariance is not positive definite; '
+                'applied diagonal loading of %g.', eps)
+        U = np.linalg.inv(Lbg)
+        self._U_bg = np.ascontiguousarray(U.T, dtype=dt)
+        self._wmeans = self._M.dot(self._U_bg)
+        self._wmeans_sq = np.einsum('cb,cb->c', self._wmeans, self._wmeans)
+
+    def _update_batch_stats(self):
+        '''Precomputes stacked class labels and means for classification.
+
+        Only the pooled background covariance matters for Mahalanobis
+        classification (it is factored in `train`), so unlike the parent
+        class, no per-class covariance is factored or inverted here --
+        classes whose own sample covariances are rank deficient are
+        perfectly valid for this classifier.
+        '''
+        self._stack_class_labels()
+        dt = np.dtype(self.score_dtype)
+        if dt != np.float64:
+            self._M = self._M.astype(dt)
 
     def classify_spectrum(self, x):
         '''
@@ -243,9 +597,46 @@ class MahalanobisDistanceClassifier(GaussianClassifier):
         scores = np.empty(len(self.classes))
         for (i, cl) in enumerate(self.classes):
             delta = (x - cl.stats.mean)
-            scores[i] = delta.dot(self.background.inv_cov).dot(delta)
+            scores[i] = delta.dot(self.background.inv_cov.dot(delta))
         return self.classes[np.argmin(scores)].index
 
+    def _class_scores(self, X):
+        '''Returns an `NxC` array of squared Mahalanobis distances from the
+        spectra in `X` to each class mean.
+
+        Since the background covariance is shared by all classes, each pixel
+        is whitened once with the triangular factor computed in `train` and
+        the per-class score is the squared Euclidean distance to that class's
+        whitened mean, expanded as |z|^2 - 2 z.m + |m|^2 so the cross term
+        is a single `NxC` GEMM.
+        '''
+        dt = np.dtype(self.score_dtype)
+        X = np.ascontiguousarray(X, dtype=dt)
+        Z = X.dot(self._U_bg)
+        scores = np.einsum('ij,ij->i', Z, Z)[:, None] - 2 * Z.dot(self._wmeans.T)
+        scores += self._wmeans_sq
+        return scores
+
+    def classify_spectra(self, X):
+        '''Classifies a batch of spectra.
+
+        Arguments:
+
+            `X` (ndarray):
+
+                An `NxB` array of spectra to classify.
+
+        Returns (ndarray):
+
+            A length-N ndarray of integers specifying the class for each
+            spectrum.
+        '''
+        if not self.cache_class_scores:
+            return super(MahalanobisDistanceClassifier,
+                         self).classify_spectra(X)
+        scores = self._class_scores(np.asarray(X))
+        return self._inds[np.argmin(scores, axis=-1)]
+
     def classify_image(self, image):
         '''Classifies an entire image, returning a classification map.
 
@@ -263,23 +654,23 @@ class MahalanobisDistanceClassifier(GaussianClassifier):
             return super(MahalanobisDistanceClassifier,
                          self).classify_image(image)
 
-        # We can cheat here and just compute RX scores for the image for each
-        # class, keeping the background covariance constant and setting the
-        # background mean to the mean of the particular class being evaluated.
-
-        scores = np.empty(image.shape[:2] + (len(self.classes),), np.float64)
         status = spy._status
         status.display_percentage('Processing...')
-        rx = RX()
-        for (i, c) in enumerate(self.classes):
-            self.background.mean = c.stats.mean
-            rx.set_background(self.background)
-            scores[:, :, i] = rx(image)
-            status.update_percentage(100. * (i + 1) / len(self.classes))
+        shape = image.shape
+        X = image.reshape(-1, shape[-1])
+        N = X.shape[0]
+        out_inds = np.empty(N, self._inds.dtype)
+        block = max(1, (2 << 20) // (shape[-1] * 8))
+        for start in range(0, N, block):
+            stop = min(start + block, N)
+            mins = self._class_scores(X[start:stop]).argmin(axis=-1)
+            if self._identity_labels:
+                out_inds[start:stop] = mins
+            else:
+                np.take(self._inds, mins, out=out_inds[start:stop])
+            status.update_percentage(100. * stop / N)
         status.end_percentage()
-        inds = np.array([c.index for c in self.classes], np.int16)
-        mins = np.argmin(scores, axis=-1)
-        return inds[mins]
+        return out_inds.reshape(shape[:2])
 
 
 class PerceptronClassifier(Perceptron, SupervisedClassifier):
@@ -161,6 +161,50 @@ class ClassifierTest(SpyTest):
         assert(mdc.classify_spectrum(data[2, 2]) == \
                mdc.classify_image(data)[2, 2])
 
+    def test_gmlc_classify_spectra_matches_spectrum(self):
+        '''classify_spectra labels match per-pixel classify_spectrum.'''
+        gmlc = spy.GaussianClassifier(self.ts, min_samples=600)
+        X = self.data[20: 30, 30: 40, :].reshape(-1, self.data.shape[-1])
+        ref = np.array([gmlc.classify_spectrum(x) for x in X])
+        assert(np.array_equal(gmlc.classify_spectra(X), ref))
+
+    def test_mahalanobis_classify_spectra_matches_spectrum(self):
+        '''classify_spectra labels match per-pixel classify_spectrum.'''
+        mdc = spy.MahalanobisDistanceClassifier(self.ts)
+        X = self.data[20: 30, 30: 40, :].reshape(-1, self.data.shape[-1])
+        ref = np.array([mdc.classify_spectrum(x) for x in X])
+        assert(np.array_equal(mdc.classify_spectra(X), ref))
+
+    def test_gmlc_numpy_fallback_matches_numba(self):
+        '''NumPy scoring path classifies the same as the numba kernel.'''
+        from spectral.algorithms import classifiers
+        gmlc = spy.GaussianClassifier(self.ts, min_samples=600)
+        data = self.data[20: 40, 30: 50, :]
+        ref = gmlc.classify_image(data)
+        have_numba = classifiers._have_numba
+        try:
+            classifiers._have_numba = False
+            result = gmlc.classify_image(data)
+        finally:
+            classifiers._have_numba = have_numba
+        assert(np.array_equal(result, ref))
+
+    def test_gmlc_serial_threaded_scores_equal(self):
+        '''score_threads=1 classifies the same as threaded scoring.'''
+        from spectral.algorithms import classifiers
+        gmlc = spy.GaussianClassifier(self.ts, min_samples=600)
+        data = self.data[20: 40, 30: 50, :]
+        have_numba = classifiers._have_numba
+        try:
+            classifiers._have_numba = False
+            gmlc.score_threads = 4
+            threaded = gmlc.classify_image(data)
+            gmlc.score_threads = 1
+            serial = gmlc.classify_image(data)
+        finally:
+            classifiers._have_numba = have_numba
+        assert(np.array_equal(threaded, serial))
+
 
 def run():
     print('\n' + '-' * 72)